@@ -20,117 +20,236 @@ import serial
 import matplotlib.pyplot as plt
 import numpy as np
 
-from scipy.fft import fft, fftfreq
+from scipy.fft import rfft, rfftfreq
 from time import sleep
 
+# optional JIT compilation of the FFT (rocket-fft enables np.fft inside of numba)
+try:
+    import numba
+    import rocket_fft
+except ImportError:
+    numba = None
+
 BOUND_RATE = 115200
+N_HEADER = 12 # number of header lines sent by DSO138 (settings, voltage and signal stats)
+N_SAMPLES = 2048 # number of channel 1 samples sent by DSO138 (one per line after the header)
+N_LINES = N_HEADER + N_SAMPLES # number of lines sent by DSO138
+FFT_WORKERS = -1 # number of threads used for FFT (-1 uses all of the cores), only for the scipy FFT (not with numba)
+T_SCALE = {'uS': 1e-6, 'mS': 1e-3, 'S': 1.0} # conversion of the time units to seconds
+
 
+def wait_serial():
+    """Default wait fcn. of get_data, sleeps while waiting for DSO138 to start sending data
 
-def get_data(port):
+    Returns:
+        bool: True, i.e. keep waiting for the data
+    """
+    sleep(0.1)
+    return True
+
+
+def get_data(port, wait=wait_serial):
     """Initializes the serial port and recieves the data from DSO138
 
     Args:
         port (str): port with USB TTL converter (e.g., COM5 for windows, /dev/ttyUSB0 for ubuntu)
+        wait (callable): called repeatedly while waiting for DSO138 to start sending data, 
+            returns False to stop waiting (e.g., when the figure is closed)
 
     Returns:
-        list: recieved data from DSO138 as list of ascii characters
+        list: recieved header lines from DSO138 (ascii strings)
+        numpy.ndarray: recieved channel 1 samples as float32 (more than enough for the 12-bit ADC)
+        (None is returned instead, if the waiting was stopped by the wait fcn.)
     """
 
-    # initialize serial port 
-    serial_port = serial.Serial(port, BOUND_RATE, timeout=1)
-    serial_port.reset_input_buffer()
-
-    print("waiting for data")
+    # initialize serial port (closed on exit of the with block, also on errors)
+    with serial.Serial(port, BOUND_RATE, timeout=1) as serial_port:
+        serial_port.reset_input_buffer()
+
+        print("waiting for data")
+
+        header = [] # init the list in which the header lines will be read
+        ch1 = np.empty(N_SAMPLES, dtype = np.float32) # init the array in which the samples will be parsed
+
+        # wait for DSO138 to start sending data
+        while serial_port.in_waiting == 0:
+            if not wait():
+                return None
+        print("receiving data")
+
+        # read the data in chunks (whatever is waiting in the input buffer) until all of the lines 
+        # are recieved (or until the transfer stops, i.e. the read times out)
+        # and parse each of the complete lines while waiting for the next chunk
+        buffer = bytearray()
+        n_lines = 0
+        while n_lines < N_LINES:
+            chunk = serial_port.read(serial_port.in_waiting or 1)
+            if not chunk:
+                break
+            buffer.extend(chunk)
+            # pull the complete lines out of the buffer
+            start = 0
+            end = buffer.find(b'\r\n')
+            while end != -1 and n_lines < N_LINES:
+                line = buffer[start:end]
+                if n_lines < N_HEADER:
+                    header.append(line.decode('ascii'))
+                else:
+                    try:
+                        ch1[n_lines - N_HEADER] = float(line.partition(b'\t')[2])
+                    except ValueError as err:
+                        raise ValueError("received malformed channel 1 data") from err
+                n_lines += 1
+                start = end + 2
+                end = buffer.find(b'\r\n', start)
+            del buffer[:start]
 
-    buffer = bytes() # init the buffer in which the data will be read
-    
-    # wait for DSO138 to start sending data
-    while serial_port.in_waiting == 0:
-        sleep(0.1)
-    print("receiving data")
-
-    # in a loop read the data from the serial port into a buffer until no new data is recieved
-    prev_buffer_size = 0
-    while True:
-        # update buffer
-        if serial_port.in_waiting > 0:
-            buffer += serial_port.read(serial_port.in_waiting)
-        # exit condition
-        if prev_buffer_size == len(buffer) and len(buffer) != 0:
-            break
-        prev_buffer_size = len(buffer)
-        sleep(0.1)
-    
-    # split the data and conver to ascii
-    raw_data = [str(line, 'ascii') for line in buffer.split(b'\r\n')]
-
-    # close the serial port
-    serial_port.close()
     print("data received")
-    return raw_data
+    return header, ch1[:max(n_lines - N_HEADER, 0)]
     
     
-def parse_data(raw_data):
+def parse_data(raw_data, ch1):
     """Parses the recieved data via serial port into a dictionary
     Only small adjustments of the original:
       https://github.com/HummusPrince/DLO-138_plotter
 
     Args:
-        raw_data (list): data recieved through serial port (from fcn. get_data)
+        raw_data (list): header lines recieved through serial port (from fcn. get_data)
+        ch1 (numpy.ndarray): channel 1 samples recieved through serial port (from fcn. get_data)
 
     Returns:
         dict: dictionary containing all data from DSO138 
     """
     plotdict = dict() 
-    plotdict ['TscaleUnits'] = raw_data[2].split()[2][:2]
-    plotdict['Tscale'] = float(raw_data[3].split()[-1])
-    if plotdict['TscaleUnits'] == 'mS':
-        plotdict['Tscale'] /= 1000
-    plotdict['coupling'] = raw_data[4].split()[2].replace(",", "")
-    plotdict['Vscale'] = raw_data[4].split()[4]
+    # split each of the header lines only once
+    timebase = raw_data[2].split()
+    sampling = raw_data[3].split()
+    channel = raw_data[4].split()
+    plotdict ['TscaleUnits'] = timebase[2][:2]
+    if plotdict['TscaleUnits'] not in T_SCALE:
+        raise ValueError("unknown time units: {}".format(plotdict['TscaleUnits']))
+    # sampling value is sent in uS, convert it to TscaleUnits
+    plotdict['Tscale'] = float(sampling[-1]) * T_SCALE['uS'] / T_SCALE[plotdict['TscaleUnits']]
+    plotdict['coupling'] = channel[2].rstrip(",")
+    plotdict['Vscale'] = channel[4]
     plotdict['VscaleUnits'] = 'mV' if plotdict['Vscale'][-6] == 'm' else 'V'
     plotdict['VoltageStats'] = raw_data[8].strip().replace(', ','\n')
     plotdict['SignalStats'] = raw_data[9].strip().replace(', ','\n')
-    # get channel 1 data and store it as numpy array
-    plotdict['ch1'] = np.array([float(i.split('\t')[1]) for i in raw_data[12:-2]])
+    # channel 1 data is already parsed while receiving (fcn. get_data)
+    plotdict['ch1'] = ch1
     # assert in case of not receiving all of the data
-    assert len(plotdict['ch1']) == 2048
+    assert len(plotdict['ch1']) == N_SAMPLES
+    # compute the time axis and the duration of the signal (in seconds) once for all plots
+    plotdict['time'] = _time_axis(plotdict)
+    plotdict['duration'] = plotdict['time'][-1] * T_SCALE[plotdict['TscaleUnits']]
     return plotdict
+
+
+def _time_axis(plotdict):
+    """Builds the time axis of the received signal (in TscaleUnits)
+
+    Args:
+        plotdict (dict): dictionary containing all data from DSO138 (obtained by fcn. parse_data)
+
+    Returns:
+        numpy.ndarray: time of each of the N_SAMPLES samples
+    """
+    return np.arange(N_SAMPLES, dtype = np.float64) * (plotdict['Tscale']/25.0)
     
     
-def plot_signal(ax, plotdict):
+def _magnitude_db(yf, N):
+    """Converts FFT of the signal to amplitude in dB (normalized by the number of samples), 
+    i.e. 20*log10(2/N*|yf|) computed directly from the squared magnitude (without DC).
+    Written to be also compiled by numba (used by both versions of fcn. fft_db).
+
+    Args:
+        yf (numpy.ndarray): FFT of the signal (non-negative frequencies)
+        N (int): number of samples of the signal
+
+    Returns:
+        numpy.ndarray: FFT amplitude [dB]
+    """
+    mag2 = yf.real*yf.real + yf.imag*yf.imag
+    return 10.0*np.log10(np.maximum(mag2[1:], 1e-30)) - 20.0*np.log10(N/2.0) # avoid log(0)
+
+
+def fft_db(ch1):
+    """Computes FFT amplitude of the signal in dB (see fcn. _magnitude_db).
+    The signal is real, so only the non-negative frequencies are computed.
+    If numba and rocket-fft are installed, it is replaced by a JIT compiled version (using np.fft).
+
+    Args:
+        ch1 (numpy.ndarray): signal received from DSO138
+
+    Returns:
+        numpy.ndarray: FFT amplitude [dB] for frequencies given by rfftfreq(N, T)[1:]
+    """
+    # (float32 input keeps the FFT in single precision, i.e. complex64 output)
+    # (scipy caches the FFT plan, so it is reused for each capture of the main loop)
+    yf = rfft(ch1, workers = FFT_WORKERS)
+    return _magnitude_db(yf, len(ch1))
+
+
+if numba is not None:
+    _magnitude_db_jit = numba.njit(cache = True, fastmath = True)(_magnitude_db)
+
+    @numba.njit(cache = True, fastmath = True)
+    def fft_db(ch1):
+        return _magnitude_db_jit(np.fft.rfft(ch1), ch1.shape[0])
+
+
+def init_plot(ax, title):
+    """Prepares the axes for plotting the data of each capture, i.e. creates 
+    an empty line which is then only updated by fcns. plot_signal and plot_fft
+
+    Args:
+        ax (matplotlib.axes): matplotlib axes onto which data will be plotted
+        title (str): title of the axes
+
+    Returns:
+        matplotlib.lines.Line2D: the empty line
+    """
+    line, = ax.plot([], [], color = '#FFFF00', linewidth = 0.1, antialiased = False, rasterized = True)
+    ax.grid(color = '#404040', linewidth = 1, antialiased = True)
+    ax.set_title(title)
+    return line
+
+
+def plot_signal(ax, line, plotdict, no_stats=False):
     """Displays the (voltage) signal received from the DSO138 together with 
     the voltage and signal stats (user can specify otherwise by a 
-    --no_stats argument flag, which is then stored in the plotdict) 
+    --no_stats argument flag) 
 
     Args:
         ax (matplotlib.axes): matplotlib axes onto which data will be plotted
+        line (matplotlib.lines.Line2D): line which will be updated with the data (from fcn. init_plot)
         plotdict (dict): dictionary containing all data from DSO138 (obtained by fcn. parse_data)
+        no_stats (bool): if True, the voltage and signal stats are not displayed
     """
-    time = [i * plotdict['Tscale']/25 for i in range(2048)]
-    ax.plot(time, plotdict['ch1'], color = '#FFFF00', linewidth = 0.1, antialiased = False)
-    ax.grid(color = '#404040', linewidth = 1, antialiased = True)
+    time = plotdict['time']
+    line.set_data(time, plotdict['ch1'])
     ax.set_xlabel('time [{}]'.format(plotdict['TscaleUnits']))
     ax.set_ylabel('voltage [{}]'.format(plotdict['VscaleUnits']))
-    ax.set_title("Signal")
-
-    # adjust the x-axis range
-    ax.set_xlim(0, max(time)) 
-    xmin, xmax = ax.get_xlim()
+    # remove the stats of the previous capture
+    for text in list(ax.texts):
+        text.remove()
 
     # display the voltage and signal stats (based on --no_stats argument)
-    if not plotdict["no_stats"]:
-        # adjust the y-axis range
-        ymin, ymax = ax.get_ylim() 
-        ymax += (ymax - ymin) * 0.3
-        ax.set_ylim(ymin, ymax)
+    if not no_stats:
+        # leave space for the stats in the y-axis range
+        ax.margins(y = 0.3)
+        # position the stats relative to the axes, so they do not depend on the data range
+        ax.text(0.95, 0.95, plotdict['VoltageStats'], transform = ax.transAxes, fontsize = 8, ha = 'right', va = 'top', ma = 'left')
+        ax.text(0.05, 0.95, plotdict['SignalStats'], transform = ax.transAxes, fontsize = 8, ha = 'left', va = 'top', ma = 'left')
 
-        ax.text(xmax*0.95, ymax*0.95, plotdict['VoltageStats'], fontsize = 8, ha = 'right', va = 'top', ma = 'left')
-        ax.text(0.05*xmax, ymax*0.95, plotdict['SignalStats'], fontsize = 8, ha = 'left', va = 'top', ma = 'left')
+    # adjust the axes range
+    ax.relim()
+    ax.autoscale(axis = 'y')
+    ax.set_xlim(0, time[-1])
 
 
 
-def plot_fft(ax, plotdict):
+def plot_fft(ax, line, plotdict, xmax=4000):
     """Computes and displays FFT of the voltage signal received from DSO138.
     No windowing is applied. 
     TODO: add parameters to control FFT
@@ -138,36 +257,26 @@ def plot_fft(ax, plotdict):
 
     Args:
         ax (matplotlib.axes): matplotlib axes onto which data will be plotted
+        line (matplotlib.lines.Line2D): line which will be updated with the data (from fcn. init_plot)
         plotdict (dict): dictionary containing all data from DSO138 (obtained by fcn. parse_data)
+        xmax (float): limit to the frequencies of FFT (in Hz)
     """
-    # get the time axis
-    time = [i * plotdict['Tscale']/25 for i in range(2048)]
-    # get the duration of the signal
-    if plotdict["TscaleUnits"] == "uS":
-        duration = time[-1] / 1e6 
-    elif plotdict["TscaleUnits"] == "mS":
-        duration = time[-1] / 1e3
-    elif plotdict["TscaleUnits"] == "S":
-        duration = time[-1]
-    else:
-        print("WARNING: something is really wrong")
-
     N = len(plotdict['ch1']) # number of samples
-    T = duration/N # compute the sampling period
+    T = plotdict['duration']/N # compute the sampling period
 
     # compute FFT
     # w = blackman(N)
-    # yf = fft(data*w)
-    yf = fft(plotdict['ch1'])
-    xf = fftfreq(N, T)[:N//2]
+    # db = fft_db(data*w)
+    db = fft_db(plotdict['ch1'])
+    xf = rfftfreq(N, T)
 
-    # plot the FFT data (normalized by the number of samples)
-    ax.semilogy(xf[1:N//2], 2.0/N * np.abs(yf[1:N//2]), color = '#FFFF00', linewidth = 0.1, antialiased = False)
-    ax.grid(color = '#404040', linewidth = 1, antialiased = True)
+    # plot the FFT data in dB
+    line.set_data(xf[1:], db)
     ax.set_xlabel('frequency [Hz]')
-    ax.set_ylabel('amplitude [{}]'.format(plotdict['VscaleUnits']))
-    ax.set_title("FFT")
-    ax.set_xlim(0, plotdict["xmax_FFT"])
+    ax.set_ylabel('amplitude [dB re {}]'.format(plotdict['VscaleUnits']))
+    ax.relim()
+    ax.autoscale(axis = 'y')
+    ax.set_xlim(0, xmax)
 
 
 def print_info(plotdict):
@@ -184,18 +293,14 @@ def print_info(plotdict):
     print("Settings: {} coupling, \tresolution: {}, \tunits: {}, {}".format(
         plotdict["coupling"],  plotdict["Vscale"], plotdict["VscaleUnits"], plotdict["TscaleUnits"]))
     # display and parse voltage stats
-    voltage_stats = plotdict["VoltageStats"].split("\n")
-    for val in voltage_stats:
-        parts = val.split(":")
-        print("{}:\t\t{} {}".format(parts[0], parts[1], plotdict["VscaleUnits"]))
+    for name, val in (stat.split(":", 1) for stat in plotdict["VoltageStats"].split("\n")):
+        print(f"{name}:\t\t{val} {plotdict['VscaleUnits']}")
     # display and parse signal stats
-    signal_stats = plotdict["SignalStats"].split("\n")
-    for val in signal_stats:
-        parts = val.split(":")
-        if parts[0] == "Freq":
-            print("{}:\t\t{} Hz".format(parts[0], parts[1]))
+    for name, val in (stat.split(":", 1) for stat in plotdict["SignalStats"].split("\n")):
+        if name == "Freq":
+            print(f"{name}:\t\t{val} Hz")
         else:
-            print("{}:\t\t{}".format(parts[0], parts[1]))
+            print(f"{name}:\t\t{val}")
     
     print("-"*60) # delimiter
     
@@ -209,32 +314,51 @@ if __name__ == "__main__":
     parser.add_argument("--xmax", type=int, default=4000, help="Limit to the frequencies of FFT")
     args = parser.parse_args()
 
-    # main loop
-    while True:
+    # --- init the figure (reused for every capture)
+    plt.style.use('dark_background')
+    # plot signal with FFT
+    if args.fft:
+        fig, axs = plt.subplots(2, 1, figsize=(12, 7) , gridspec_kw={'height_ratios': [2, 1]})
+        line_sig = init_plot(axs[0], "Signal")
+        line_fft = init_plot(axs[1], "FFT")
+        # compile (or load from the cache) the JIT version of the FFT before the first capture
+        if numba is not None:
+            fft_db(np.zeros(N_SAMPLES, dtype = np.float32))
+    # plot only signal
+    else:
+        fig, axs = plt.subplots(1, 1, figsize=(12, 7))
+        line_sig = init_plot(axs, "Signal")
+
+    fig.subplots_adjust(hspace=0.5)
+    fig.suptitle('Oscilloscope DLO-138', fontsize=16)
+    plt.show(block=False)
+
+    def wait_figure():
+        """Keeps the figure responsive while waiting for the data, stops waiting once it is closed"""
+        if plt.fignum_exists(fig.number):
+            plt.pause(0.1)
+        return plt.fignum_exists(fig.number)
+
+    # main loop (until the figure is closed)
+    while plt.fignum_exists(fig.number):
         # init serial port and wait for the data
-        raw_data = get_data(args.port)
+        data = get_data(args.port, wait_figure)
+        if data is None:
+            break
+        raw_data, ch1 = data
         # parse the recieved data
-        plotdict = parse_data(raw_data)
+        plotdict = parse_data(raw_data, ch1)
         # show info about the DSO138 settings with voltage and signal stats
         print_info(plotdict)
-        # update the plotdict with user arguments
-        plotdict["xmax_FFT"] = args.xmax
-        plotdict["no_stats"] = args.no_stats
     
         # --- plotting
-        plt.style.use('dark_background')
-        # plot signal with FFT
         if args.fft:
-            fig, axs = plt.subplots(2, 1, figsize=(12, 7) , gridspec_kw={'height_ratios': [2, 1]})
-            plot_signal(axs[0], plotdict)
-            plot_fft(axs[1], plotdict)
-        # plot only signal
+            plot_signal(axs[0], line_sig, plotdict, args.no_stats)
+            plot_fft(axs[1], line_fft, plotdict, args.xmax)
         else:
-            fig, axs = plt.subplots(1, 1, figsize=(12, 7))
-            plot_signal(axs, plotdict)
+            plot_signal(axs, line_sig, plotdict, args.no_stats)
 
-        fig.subplots_adjust(hspace=0.5)
-        fig.suptitle('Oscilloscope DLO-138', fontsize=16)
         # update plot
-        plt.show()
+        fig.canvas.draw_idle()
+        plt.pause(0.001)
         
\ No newline at end of file